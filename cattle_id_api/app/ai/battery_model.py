@@ -40,18 +40,36 @@ class BatteryPredictor:
         
         return new_model
 
-    def predict(self, voltage, percent):
-        # Use the AI Model
+    def _forecast(self, features):
+        """Returns (hours array, estimated flag) for an (n, 2) [voltage, percent] matrix."""
+        # Use the AI Model (one call for the whole matrix)
         if self.model:
             try:
-                features = np.array([[voltage, percent]])
-                prediction = self.model.predict(features)[0]
-                return f"{round(prediction, 1)} hours remaining"
+                return np.clip(self.model.predict(features), 0, None), False
             except Exception:
                 pass # Fail silently to math fallback if calculation errs
-        
+
         # Math Fallback (Just in case)
-        return f"{percent * 0.5} hours remaining (Estimated)"
+        return np.clip(features[:, 1] * 0.5, 0, None), True
+
+    def predict_hours(self, features):
+        """
+        Vectorized forecast for many collars at once. 'features' is an (n, 2)
+        array of [voltage, percent] rows; returns n hours-remaining values
+        (NaN for rows with a missing/non-finite reading).
+        """
+        features = np.asarray(features, dtype=float).reshape(-1, 2)
+        hours = np.full(len(features), np.nan)
+
+        # Non-finite rows get NaN instead of pushing the whole batch onto the fallback
+        valid = np.isfinite(features).all(axis=1)
+        if valid.any():
+            hours[valid] = self._forecast(features[valid])[0]
+        return hours
+
+    def predict(self, voltage, percent):
+        hours, estimated = self._forecast(np.array([[voltage, percent]], dtype=float))
+        return f"{round(float(hours[0]), 1)} hours remaining" + (" (Estimated)" if estimated else "")
 
 # Create the instance
 battery_predictor = BatteryPredictor()
\ No newline at end of file
@@ -3,42 +3,47 @@ import joblib
 import asyncio
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LinearRegression
+from app.core.config import settings
 from app.services.db_manager import db_instance
+from app.services.telemetry_archive import telemetry_archive, flatten_fix
 from geopy.distance import geodesic
 
 HEALTH_MODEL_PATH = "app/ai/models/health_model.pkl"
 BATTERY_MODEL_PATH = "app/ai/models/battery_model.pkl"
 
-async def train_models():
-    print("--- 🚀 Starting AI Training (Fixed) ---")
+TRAINING_COLUMNS = ["device_id", "ts_ms", "gps_lat", "gps_lon", "battery_voltage", "battery_percent", "label"]
+
+async def load_training_frame():
+    """Reads flat fixes from the local archive, falling back to a Mongo scan."""
+    if telemetry_archive.exists():
+        print("Reading fixes from local archive...")
+        # Only the labeled training export: live device snapshots have no
+        # meaningful 'hours_left' target (the collars are still running)
+        return await asyncio.to_thread(telemetry_archive.to_pandas, TRAINING_COLUMNS, settings.TRAINING_COLLECTION)
+
+    print("No archive found. Scanning MongoDB...")
     await db_instance.connect_to_database()
-    
-    # 1. Fetch Data
-    collection = db_instance.db["dummy_data_CSV_labeled"]
+    collection = db_instance.db[settings.TRAINING_COLLECTION]
     cursor = collection.find({})
     data = await cursor.to_list(length=10000)
-    
-    if not data:
-        print("❌ No data found.")
-        return
+    rows = [row for row in (flatten_fix(doc, settings.TRAINING_COLLECTION) for doc in data) if row]
+    return pd.DataFrame(rows, columns=TRAINING_COLUMNS)
 
-    df_raw = pd.DataFrame(data)
+async def train_models():
+    print("--- 🚀 Starting AI Training (Fixed) ---")
 
-    # --- THE FIX IS HERE ---
-    # We extract 'ts_ms' from the battery object and make it a real column
-    print("Extracting timestamps...")
-    try:
-        df_raw['ts_ms'] = df_raw['battery'].apply(lambda x: x.get('ts_ms'))
-    except Exception as e:
-        print(f"❌ Error extracting timestamps: {e}")
+    # 1. Fetch Data (already flat: gps_* / battery_* / ts_ms columns)
+    df_raw = await load_training_frame()
+
+    if df_raw.empty:
+        print("❌ No data found.")
         return
 
-    # Now we can safely sort
     health_rows = []
     battery_rows = []
 
     for device_id, group in df_raw.groupby("device_id"):
-        # Sort by the new extracted column
+        # Sort by fix time
         group = group.sort_values("ts_ms")
         max_time = group["ts_ms"].max()
         
@@ -50,12 +55,11 @@ async def train_models():
             hours_left = time_left_ms / (1000 * 60 * 60)
             
             try:
-                # Extract voltage/percent safely
-                volts = curr["battery"]["voltage"]
-                perc = curr["battery"]["percent"]
+                volts = curr["battery_voltage"]
+                perc = curr["battery_percent"]
                 
                 # Only train if we have valid time left
-                if hours_left >= 0:
+                if hours_left >= 0 and pd.notna(volts) and pd.notna(perc):
                     battery_rows.append({
                         "voltage": volts,
                         "percent": perc,
@@ -64,11 +68,12 @@ async def train_models():
             except: pass
 
             # --- HEALTH LOGIC ---
-            if i > 0:
+            # Only labeled fixes (the devices export has no 'label')
+            if i > 0 and pd.notna(curr["label"]):
                 prev = group.iloc[i-1]
                 try:
-                    p1 = (prev["gps"]["lat"], prev["gps"]["lon"])
-                    p2 = (curr["gps"]["lat"], curr["gps"]["lon"])
+                    p1 = (prev["gps_lat"], prev["gps_lon"])
+                    p2 = (curr["gps_lat"], curr["gps_lon"])
                     
                     dist = geodesic(p1, p2).meters
                     time_diff = (curr["ts_ms"] - prev["ts_ms"]) / 1000.0
@@ -97,7 +102,7 @@ async def train_models():
         joblib.dump(reg, BATTERY_MODEL_PATH)
         print(f"✅ Battery Model Saved ({len(df_batt)} records)")
         
-    await db_instance.close_database_connection()
+    if db_instance.client: await db_instance.close_database_connection()
     print("--- Training Complete ---")
 
 if __name__ == "__main__":
@@ -1,13 +1,21 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import httpx 
 import math # <--- Needed to fix the Error
+import time
+import numpy as np
 
+from cattle_id_api.app.core.config import settings
+from cattle_id_api.app.core.profiling import profile_request, is_authorized, get_profile_path
 from cattle_id_api.app.services.db_manager import db_instance
 from cattle_id_api.app.services.geo_analyzer import analyzer
 from cattle_id_api.app.ai.health_model import health_predictor
 from cattle_id_api.app.ai.battery_model import battery_predictor
+from cattle_id_api.app.services.telemetry_archive import telemetry_archive
+from cattle_id_api.app.services.position_index import position_index
 
 router = APIRouter()
 
@@ -42,6 +50,44 @@ class AnalysisResponse(BaseModel):
     ai_analysis: AIAnalysis
     detected_objects: List[dict]
 
+class BatteryForecast(BaseModel):
+    cattle_id: str
+    voltage: float
+    percent: float
+    hours_remaining: float
+
+class FleetBatteryResponse(BaseModel):
+    count: int
+    max_hours: Optional[float] = None
+    devices: List[BatteryForecast]
+
+class Neighbour(BaseModel):
+    cattle_id: str
+    distance_m: float
+    location: Dict[str, float]
+    updated_ms: int
+
+class NearbyResponse(BaseModel):
+    count: int
+    radius_m: float
+    cattle: List[Neighbour]
+
+class NearestResponse(BaseModel):
+    k: int
+    neighbours: Dict[str, List[Neighbour]]
+
+class TrackPoint(BaseModel):
+    ts_ms: int
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    voltage: Optional[float] = None
+    percent: Optional[float] = None
+
+class HistoryResponse(BaseModel):
+    cattle_id: str
+    count: int
+    track: List[TrackPoint]
+
 # --- 🧹 THE SANITIZER FUNCTION (Fixes the Crash) ---
 def clean_data(data):
     """
@@ -86,7 +132,12 @@ async def send_emergency_alert(cattle_id: str, location: dict, ai_data: dict, ob
 
 # --- API Endpoint ---
 @router.post("/analyze", response_model=AnalysisResponse)
-async def analyze_cattle_position(request: AnalysisRequest):
+async def analyze_cattle_position(request: AnalysisRequest, raw_request: Request, response: Response):
+    # Opt-in profiling: X-Profile: 1 header or ?profile=1 (see core/profiling.py)
+    async with profile_request(raw_request, response, f"analyze_{request.cattle_id}"):
+        return await run_analysis(request)
+
+async def run_analysis(request: AnalysisRequest):
     
     # Fetch Data
     cattle_data = await db_instance.get_cattle_position(request.cattle_id)
@@ -135,6 +186,16 @@ async def analyze_cattle_position(request: AnalysisRequest):
     else:
         alert_payload = AlertData(triggered=False, title="Safe", message="Normal", severity="low")
 
+    # Persist computed state (buffered, written in bulk by DBManager)
+    await db_instance.queue_status_update(request.cattle_id, clean_data({
+        "user_id": request.user_id,
+        "is_safe": bool(geo_result["is_safe"]),
+        "location": geo_result["cattle_location"],
+        "health_status": str(health_status),
+        "battery_forecast": battery_msg,
+        "updated_ms": int(time.time() * 1000)
+    }))
+
     # Sanitize the final response too, just in case
     final_response = {
         "status": "success",
@@ -148,4 +209,99 @@ async def analyze_cattle_position(request: AnalysisRequest):
         "detected_objects": geo_result["detected_objects"]
     }
     
-    return clean_data(final_response)  
\ No newline at end of file
+    return clean_data(final_response)
+
+# --- History Endpoint (served from the local archive, not MongoDB) ---
+@router.get("/history/{cattle_id}", response_model=HistoryResponse)
+async def get_cattle_history(cattle_id: str, start_ms: Optional[int] = None, end_ms: Optional[int] = None, limit: int = Query(5000, ge=1)):
+    # Parquet reads are blocking, keep them off the event loop
+    track = await run_in_threadpool(telemetry_archive.get_track, cattle_id, start_ms, end_ms, limit)
+    if not track:
+        raise HTTPException(status_code=404, detail="No archived track for this cattle.")
+
+    return clean_data({"cattle_id": cattle_id, "count": len(track), "track": track})
+
+# --- Fleet Battery Forecast ---
+# user_id (None = whole fleet) -> (expires_at, ids, hours, voltages, percents)
+_fleet_forecast_cache = {}
+
+async def _get_fleet_forecast(user_id: Optional[str]):
+    cached = _fleet_forecast_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1:]
+
+    cattle_ids = await db_instance.get_user_cattle_ids(user_id) if user_id else None
+    ids, voltages, percents = await db_instance.get_fleet_battery(cattle_ids)
+
+    # One vectorized predict over the whole (n, 2) matrix
+    voltages, percents = np.array(voltages, dtype=float), np.array(percents, dtype=float)
+    hours = battery_predictor.predict_hours(np.column_stack([voltages, percents]))
+
+    result = (np.array(ids, dtype=object), hours, voltages, percents)
+    now = time.monotonic()
+    for key in [k for k, v in _fleet_forecast_cache.items() if v[0] <= now]:
+        del _fleet_forecast_cache[key] # Drop expired users so the cache stays small
+    _fleet_forecast_cache[user_id] = (now + settings.BATTERY_FORECAST_TTL, *result)
+    return result
+
+@router.get("/battery/forecast", response_model=FleetBatteryResponse)
+async def fleet_battery_forecast(user_id: Optional[str] = None, max_hours: float = Query(24, ge=0), order: str = "asc", limit: Optional[int] = Query(None, ge=1)):
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'.")
+
+    # max_hours=0 turns the threshold off (whole fleet)
+    max_hours = max_hours or None
+
+    ids, hours, voltages, percents = await _get_fleet_forecast(user_id)
+
+    # Filter + sort on the arrays, then build only the rows we return
+    selected = np.flatnonzero(hours <= max_hours) if max_hours is not None else np.arange(len(hours))
+    selected = selected[np.argsort(hours[selected], kind="stable")]
+    if order == "desc":
+        selected = selected[::-1]
+    if limit is not None:
+        selected = selected[:limit]
+
+    devices = [
+        {
+            "cattle_id": str(ids[i]),
+            "voltage": float(voltages[i]),
+            "percent": float(percents[i]),
+            "hours_remaining": round(float(hours[i]), 1)
+        }
+        for i in selected
+    ]
+    return clean_data({"count": len(devices), "max_hours": max_hours, "devices": devices})
+
+# --- Herd Proximity (served from the in-memory position index) ---
+@router.get("/herd/nearby", response_model=NearbyResponse)
+async def herd_nearby(lat: float = Query(..., ge=-90, le=90), lon: float = Query(..., ge=-180, le=180), radius_m: float = Query(200, gt=0), user_id: Optional[str] = None):
+    cattle_ids = await db_instance.get_user_cattle_ids(user_id) if user_id else None
+    cattle = position_index.within_radius(lat, lon, radius_m, cattle_ids)
+    return {"count": len(cattle), "radius_m": radius_m, "cattle": cattle}
+
+@router.get("/herd/nearest", response_model=NearestResponse)
+async def herd_nearest(cattle_id: Optional[str] = None, k: int = Query(1, ge=1), user_id: Optional[str] = None):
+    # With user_id, only that user's herd is queried AND returned as neighbours
+    cattle_ids = await db_instance.get_user_cattle_ids(user_id) if user_id else None
+
+    # One animal
+    if cattle_id:
+        neighbours = position_index.nearest(cattle_id, k, cattle_ids)
+        if neighbours is None:
+            raise HTTPException(status_code=404, detail="Cattle position not indexed.")
+        return {"k": k, "neighbours": {cattle_id: neighbours}}
+
+    # Every animal (optionally only a user's herd)
+    return {"k": k, "neighbours": position_index.nearest_all(k, cattle_ids)}
+
+# --- Saved Profiles (same access rules as taking one) ---
+@router.get("/profiles/{filename}")
+async def download_profile(filename: str, raw_request: Request):
+    if not is_authorized(raw_request):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Profiling is disabled.")
+
+    path = get_profile_path(filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(path, media_type="application/json", filename=filename)
@@ -11,5 +11,41 @@ class Settings:
     # Defaults set to match your architecture
     CATTLE_COLLECTION: str = os.getenv("CATTLE_COLLECTION", "devices").strip()
     POLYGON_COLLECTION: str = os.getenv("POLYGON_COLLECTION", "geofence").strip()
+    STATUS_COLLECTION: str = os.getenv("STATUS_COLLECTION", "cattle_status").strip()
+    TRAINING_COLLECTION: str = os.getenv("TRAINING_COLLECTION", "dummy_data_CSV_labeled").strip()
+
+    # Local columnar archive of device fixes (Parquet, partitioned by device + day)
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "archive")).strip()
     
+    # Write-behind buffer for computed per-animal status (fence, health, battery)
+    STATUS_FLUSH_SIZE: int = int(os.getenv("STATUS_FLUSH_SIZE", "500"))
+    STATUS_FLUSH_INTERVAL: float = float(os.getenv("STATUS_FLUSH_INTERVAL", "1.0"))
+    STATUS_BUFFER_MAX: int = int(os.getenv("STATUS_BUFFER_MAX", "5000"))
+
+    # Seconds a fleet battery forecast is reused before re-reading MongoDB
+    BATTERY_FORECAST_TTL: float = float(os.getenv("BATTERY_FORECAST_TTL", "60"))
+
+    # Opt-in request profiling (X-Profile: 1 header or ?profile=1), off by default
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+    PROFILING_TOKEN: str = os.getenv("PROFILING_TOKEN", "").strip()
+    PROFILING_INTERVAL: float = float(os.getenv("PROFILING_INTERVAL", "0.001"))
+    PROFILE_MAX_FILES: int = int(os.getenv("PROFILE_MAX_FILES", "50"))
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "profiles")).strip()
+
+    # Node-local cache of OSM feature sets shared by all uvicorn workers.
+    # /dev/shm keeps it in RAM; any local directory works (it then also survives reboots).
+    SHARED_CACHE_DIR: str = os.getenv("SHARED_CACHE_DIR", "/dev/shm/moomap_cache" if os.path.isdir("/dev/shm") else os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "shared_cache")).strip()
+    SHARED_CACHE_TTL: float = float(os.getenv("SHARED_CACHE_TTL", str(24 * 60 * 60))) # OSM data changes; re-fetch daily
+    SHARED_CACHE_MAX_BYTES: int = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+    # Herd proximity index: poll interval for new fixes, min seconds between tree rebuilds.
+    # Polls read devices whose DEVICE_UPDATED_FIELD (set by the ingest on every write,
+    # only ever increasing) is at or after the last value seen. It needs an index:
+    #   db.devices.createIndex({updatedAt: 1})
+    # Without that field only the periodic full reload runs.
+    DEVICE_UPDATED_FIELD: str = os.getenv("DEVICE_UPDATED_FIELD", "updatedAt").strip()
+    POSITION_REFRESH_INTERVAL: float = float(os.getenv("POSITION_REFRESH_INTERVAL", "5"))
+    POSITION_FULL_RELOAD_INTERVAL: float = float(os.getenv("POSITION_FULL_RELOAD_INTERVAL", "300"))
+    POSITION_REBUILD_INTERVAL: float = float(os.getenv("POSITION_REBUILD_INTERVAL", "1.0"))
+
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,92 @@
+import os
+import re
+import time
+import hmac
+import logging
+from contextlib import asynccontextmanager
+
+from cattle_id_api.app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError: # Optional: profiling just stays off without it
+    Profiler = None
+
+PROFILE_HEADER = "X-Profile"
+TOKEN_HEADER = "X-Profile-Token"
+FILE_HEADER = "X-Profile-File"
+
+def is_authorized(raw_request):
+    """Profiling must be enabled in config, and the token must match if one is set."""
+    if not settings.PROFILING_ENABLED or Profiler is None:
+        return False
+    if settings.PROFILING_TOKEN:
+        token = raw_request.headers.get(TOKEN_HEADER, "")
+        return hmac.compare_digest(token, settings.PROFILING_TOKEN)
+    return True
+
+def is_requested(raw_request):
+    flag = raw_request.headers.get(PROFILE_HEADER) or raw_request.query_params.get("profile")
+    return flag is not None and flag.lower() in ("1", "true", "yes")
+
+@asynccontextmanager
+async def profile_request(raw_request, response, name):
+    """
+    Samples everything awaited inside the block (geo analysis, predictors, DB calls)
+    when the caller asked for it and is allowed to. The profile is saved as a
+    speedscope JSON file (opens in speedscope.app as a flamegraph) and its file
+    name is returned in the X-Profile-File response header.
+    """
+    if not (is_requested(raw_request) and is_authorized(raw_request)):
+        yield
+        return
+
+    profiler = Profiler(interval=settings.PROFILING_INTERVAL, async_mode="enabled")
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", name)
+        filename = f"{safe_name}_{int(time.time() * 1000)}.speedscope.json"
+
+        # No 'return' in here: it would swallow exceptions raised by the handler
+        saved = False
+        try:
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(settings.PROFILE_DIR, filename), "w", encoding="utf-8") as f:
+                f.write(profiler.output(SpeedscopeRenderer()))
+            saved = True
+        except OSError as e:
+            # A diagnostics failure must never break the profiled request
+            logger.warning(f"Could not save request profile: {e}")
+
+        if saved:
+            response.headers[FILE_HEADER] = filename
+            logger.info(f"Request profile saved: {filename}")
+            try:
+                _rotate_profiles()
+            except OSError as e:
+                logger.warning(f"Could not rotate request profiles: {e}")
+
+def _rotate_profiles():
+    """Keeps only the newest PROFILE_MAX_FILES profiles."""
+    profiles = sorted(
+        (entry for entry in os.scandir(settings.PROFILE_DIR) if entry.name.endswith(".speedscope.json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:max(len(profiles) - settings.PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass # Another worker rotated it already
+
+def get_profile_path(filename):
+    """Absolute path of a saved profile, or None if the name is invalid or missing."""
+    if os.path.basename(filename) != filename or not filename.endswith(".speedscope.json"):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, filename)
+    return path if os.path.isfile(path) else None
@@ -1,20 +1,120 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 from cattle_id_api.app.core.config import settings
+from cattle_id_api.app.services.position_index import position_index
+import asyncio
 import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
 
 class DBManager:
     def __init__(self):
         self.client = None
         self.db = None
 
+        # Write-behind buffer: cattle_id -> latest computed fields
+        self._status_buffer = {}
+        self._inflight = 0 # Size of the batch currently being written (counts against the cap)
+        self._flush_lock = asyncio.Lock()
+        self._flush_now = asyncio.Event()
+        self._stopping = False
+        self._flusher_task = None
+
+        # Herd proximity index refresh: newest DEVICE_UPDATED_FIELD value seen so far
+        self._positions_watermark = None
+        self._position_task = None
+
     async def connect_to_database(self):
         self.client = AsyncIOMotorClient(settings.MONGO_URI)
         self.db = self.client[settings.DB_NAME]
+        self._stopping = False
+        self._flusher_task = asyncio.create_task(self._status_flusher())
         print(f"✅ Connected to DB: {settings.DB_NAME}")
 
     async def close_database_connection(self):
+        if self._position_task:
+            self._position_task.cancel() # Read-only, safe to cancel anywhere
+            try:
+                await self._position_task
+            except asyncio.CancelledError:
+                pass
+            self._position_task = None
+
+        # Ask the flusher to stop (never cancel it mid bulk_write), wait for it,
+        # then drain whatever is still buffered
+        if self._flusher_task:
+            self._stopping = True
+            self._flush_now.set()
+            await self._flusher_task
+            self._flusher_task = None
+        await self.flush_status_updates()
+
         if self.client: self.client.close()
 
+    # --- Buffered Status Writes ---
+
+    async def queue_status_update(self, cattle_id: str, fields: dict):
+        """
+        Buffers computed state for one animal. Repeated updates for the same
+        animal are merged, so only the latest values hit MongoDB.
+        Blocks (backpressure) while buffered + in-flight updates reach
+        STATUS_BUFFER_MAX, until a successful flush makes room.
+        """
+        while (len(self._status_buffer) + self._inflight >= settings.STATUS_BUFFER_MAX
+               and cattle_id not in self._status_buffer):
+            if not await self.flush_status_updates():
+                # Mongo is unavailable: wait before retrying instead of hammering it
+                await asyncio.sleep(settings.STATUS_FLUSH_INTERVAL)
+
+        self._status_buffer.setdefault(cattle_id, {}).update(fields)
+
+        if len(self._status_buffer) >= settings.STATUS_FLUSH_SIZE:
+            self._flush_now.set()
+
+    async def flush_status_updates(self):
+        """Writes all buffered updates as one unordered bulk_write of upserts."""
+        async with self._flush_lock:
+            if not self._status_buffer or self.db is None: return 0
+
+            pending, self._status_buffer = self._status_buffer, {}
+            self._inflight = len(pending)
+            operations = [
+                UpdateOne({"_id": cattle_id}, {"$set": fields}, upsert=True)
+                for cattle_id, fields in pending.items()
+            ]
+
+            try:
+                await self.db[settings.STATUS_COLLECTION].bulk_write(operations, ordered=False)
+            except asyncio.CancelledError:
+                self._requeue(pending)
+                raise
+            except Exception as e:
+                logger.error(f"Status flush failed ({len(operations)} updates): {e}")
+                self._requeue(pending)
+                return 0
+            finally:
+                self._inflight = 0
+
+            return len(operations)
+
+    def _requeue(self, pending):
+        # Put a failed batch back, without overwriting anything newer queued meanwhile.
+        # Writers were held to buffer + in-flight <= STATUS_BUFFER_MAX, so the merge stays under the cap.
+        for cattle_id, fields in pending.items():
+            self._status_buffer[cattle_id] = {**fields, **self._status_buffer.get(cattle_id, {})}
+
+    async def _status_flusher(self):
+        # Flush on size (event) or time (timeout), whichever comes first
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=settings.STATUS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush_status_updates()
+
     async def get_cattle_position(self, cattle_id: str):
         if self.db is None: return None
         
@@ -23,30 +123,113 @@ class DBManager:
         document = await collection.find_one({"_id": cattle_id})
         
         # 2. Extract Data (Handling 'meta' structure)
-        if document:
-            # Check inside 'meta' first (Primary Source)
-            if "meta" in document and "gps" in document["meta"]:
-                meta = document["meta"]
-                return {
-                    "latitude": float(meta["gps"].get("lat", 0)),
-                    "longitude": float(meta["gps"].get("lon", 0)),
-                    "cattle_id": document.get("_id"),
-                    "voltage": meta.get("battery", {}).get("voltage", 0),
-                    "percent": meta.get("battery", {}).get("percent", 0)
-                }
-            
-            # Check Root level (Fallback)
-            elif "gps" in document:
-                return {
-                    "latitude": float(document["gps"].get("lat", 0)),
-                    "longitude": float(document["gps"].get("lon", 0)),
-                    "cattle_id": document.get("_id"),
-                    "voltage": document.get("battery", {}).get("voltage", 0),
-                    "percent": document.get("battery", {}).get("percent", 0)
-                }
+        position = self._extract_position(document) if document else None
+        if position:
+            # Keep the proximity index in step with every device read
+            position_index.update(position["cattle_id"], position["latitude"], position["longitude"], self._extract_ts_ms(document))
+        return position
+
+    def _extract_position(self, document):
+        # Check inside 'meta' first (Primary Source)
+        meta = document.get("meta") or {}
+        if "gps" in meta:
+            return {
+                "latitude": float(meta["gps"].get("lat", 0)),
+                "longitude": float(meta["gps"].get("lon", 0)),
+                "cattle_id": document.get("_id"),
+                "voltage": meta.get("battery", {}).get("voltage", 0),
+                "percent": meta.get("battery", {}).get("percent", 0)
+            }
+
+        # Check Root level (Fallback)
+        elif "gps" in document:
+            return {
+                "latitude": float(document["gps"].get("lat", 0)),
+                "longitude": float(document["gps"].get("lon", 0)),
+                "cattle_id": document.get("_id"),
+                "voltage": document.get("battery", {}).get("voltage", 0),
+                "percent": document.get("battery", {}).get("percent", 0)
+            }
 
         return None
 
+    def _extract_ts_ms(self, document):
+        # Fix time, same lookup order as the archive export (battery, then meta/root)
+        source = document.get("meta") or {}
+        if "gps" not in source: source = document
+        ts_ms = (source.get("battery") or {}).get("ts_ms", source.get("ts_ms"))
+        try:
+            return int(ts_ms) if ts_ms is not None else None
+        except (ValueError, TypeError):
+            return None
+
+    def _updated_value(self, document):
+        value = document
+        for part in settings.DEVICE_UPDATED_FIELD.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    async def refresh_positions(self, full=False):
+        """
+        Pulls device positions into the proximity index: every device when 'full',
+        otherwise only devices written since the last poll (ingest order, via
+        DEVICE_UPDATED_FIELD, so late uploads with old fix times are still seen).
+        """
+        if self.db is None: return 0
+
+        field = settings.DEVICE_UPDATED_FIELD
+        query = {}
+        if not full:
+            if self._positions_watermark is None: return 0
+            query = {field: {"$gte": self._positions_watermark}}
+
+        collection = self.db[settings.CATTLE_COLLECTION]
+        projection = {"meta.gps": 1, "meta.battery.ts_ms": 1, "meta.ts_ms": 1, "gps": 1, "battery.ts_ms": 1, "ts_ms": 1, field: 1}
+        cursor = collection.find(query, projection, batch_size=5000)
+
+        positions = []
+        watermark = self._positions_watermark
+        async for document in cursor:
+            try:
+                updated = self._updated_value(document)
+                if updated is not None and (watermark is None or updated > watermark):
+                    watermark = updated
+            except TypeError:
+                pass # Mixed types in the field: ignore this value
+
+            try:
+                position = self._extract_position(document)
+            except (ValueError, TypeError):
+                continue # Skip bad coordinates
+            if not position: continue
+
+            positions.append((position["cattle_id"], position["latitude"], position["longitude"], self._extract_ts_ms(document)))
+
+        position_index.update_many(positions)
+        self._positions_watermark = watermark
+        return len(positions)
+
+    def start_position_refresh(self):
+        """Keeps the proximity index current in the background (API server only)."""
+        # Best-effort: a slow or unreachable Mongo must not block startup
+        if self._position_task is None:
+            self._position_task = asyncio.create_task(self._position_refresher())
+
+    async def _position_refresher(self):
+        # Incremental polls every POSITION_REFRESH_INTERVAL, plus a periodic full
+        # reload as a safety net (also the only mode if devices lack the updated field)
+        last_full = None
+        while True:
+            try:
+                if last_full is None or time.monotonic() - last_full >= settings.POSITION_FULL_RELOAD_INTERVAL:
+                    await self.refresh_positions(full=True)
+                    last_full = time.monotonic()
+                else:
+                    await self.refresh_positions()
+            except Exception as e:
+                logger.warning(f"Position index refresh failed: {e}")
+            await asyncio.sleep(settings.POSITION_REFRESH_INTERVAL)
+
     async def get_relevant_polygon(self, user_id: str, cattle_id: str):
         # 1. Search in the correct collection (geofences)
         collection = self.db[settings.POLYGON_COLLECTION]
@@ -71,4 +254,45 @@ class DBManager:
                 return clean_polygon
         return None
 
+    async def get_user_cattle_ids(self, user_id: str):
+        """All cattle assigned to any of the user's geofences."""
+        collection = self.db[settings.POLYGON_COLLECTION]
+        user_doc = await collection.find_one({"userId": user_id}, {"geofences.cattleIds": 1})
+        if not user_doc: return []
+
+        cattle_ids = set()
+        for fence in user_doc.get("geofences", []):
+            cattle_ids.update(fence.get("cattleIds", []))
+        return list(cattle_ids)
+
+    async def get_fleet_battery(self, cattle_ids=None):
+        """
+        Bulk-reads battery fields for many devices in one query.
+        Returns (ids, voltages, percents) lists; only the battery sub-documents are fetched.
+        """
+        if self.db is None: return [], [], []
+
+        collection = self.db[settings.CATTLE_COLLECTION]
+        query = {} if cattle_ids is None else {"_id": {"$in": list(cattle_ids)}}
+        cursor = collection.find(query, {"meta.battery": 1, "battery": 1}, batch_size=5000)
+
+        ids, voltages, percents = [], [], []
+        async for document in cursor:
+            # Same 'meta' first, root fallback rule as get_cattle_position
+            battery = (document.get("meta") or {}).get("battery") or document.get("battery")
+            if not battery: continue
+            try:
+                # No default: a collar without a reading must not look like an empty battery
+                voltage = float(battery["voltage"])
+                percent = float(battery["percent"])
+            except (KeyError, ValueError, TypeError):
+                continue # Skip missing / bad readings
+            if not (math.isfinite(voltage) and math.isfinite(percent)):
+                continue # NaN / inf would break the batched predict for everyone
+            ids.append(document["_id"])
+            voltages.append(voltage)
+            percents.append(percent)
+
+        return ids, voltages, percents
+
 db_instance = DBManager()
\ No newline at end of file
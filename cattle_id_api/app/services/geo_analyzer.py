@@ -4,9 +4,23 @@ import osmnx as ox
 from shapely.geometry import Point, Polygon
 from shapely.errors import TopologicalError
 import logging
+from cattle_id_api.app.services.shared_cache import shared_cache
+
+try:
+    from osmnx._errors import InsufficientResponseError
+except ImportError: # Older osmnx layouts
+    InsufficientResponseError = getattr(ox, "InsufficientResponseError", LookupError)
 
 logger = logging.getLogger(__name__)
 
+# Define what OSM tags we are looking for
+# You can add more tags here based on what you want to detect
+OSM_TAGS = {
+    'building': True,  # All buildings
+    'natural': ['tree', 'water', 'wood'], # Trees and water
+    'landuse': ['forest', 'residential', 'farmland'] # Areas
+}
+
 class GeoAnalyzer:
     def __init__(self):
         # Configure osmnx to be useful for API responses
@@ -30,23 +44,24 @@ class GeoAnalyzer:
         point = Point(cattle_lon, cattle_lat) # Note order: Lon, Lat
         return polygon_obj.contains(point)
 
-    def scan_for_features(self, polygon_obj):
+    def scan_for_features(self, polygon_obj, cache_key=None):
         """
         Uses OSMnx to find features (houses, trees, water) INSIDE the polygon.
+        When cache_key is given, the formatted list is cached per fence in the
+        shared cache, so other workers skip the GeoDataFrame build and iterrows
+        (osmnx's own HTTP cache already avoids the Overpass round trip).
         """
+        if cache_key:
+            cache_key = shared_cache.key_for(cache_key, OSM_TAGS)
+            cached = shared_cache.get_features(cache_key)
+            if cached is not None:
+                return cached
+
         features_found = []
-        
-        # Define what OSM tags we are looking for
-        # You can add more tags here based on what you want to detect
-        tags = {
-            'building': True,  # All buildings
-            'natural': ['tree', 'water', 'wood'], # Trees and water
-            'landuse': ['forest', 'residential', 'farmland'] # Areas
-        }
 
         try:
             # 1. Fetch data from OpenStreetMap for this specific polygon area
-            gdf = ox.features_from_polygon(polygon_obj, tags)
+            gdf = ox.features_from_polygon(polygon_obj, OSM_TAGS)
 
             # 2. Process the results
             if not gdf.empty:
@@ -75,11 +90,18 @@ class GeoAnalyzer:
                         "name": row.get('name', 'Unnamed Object') # Get name if available
                     })
                     
+        except InsufficientResponseError:
+            # No matching features (common for open pasture): a valid, cacheable empty result
+            logger.info("OSM lookup found no features in this fence")
+
         except Exception as e:
-            # If OSM returns no data or fails, we just log it and return empty list
+            # If OSM fails (network / HTTP / parsing), we just log it and return empty list
             # We don't want to crash the whole app just because OSM failed.
-            logger.warning(f"OSM lookup failed or found nothing: {e}")
+            logger.warning(f"OSM lookup failed: {e}")
+            return features_found # Not cached, so the next request retries OSM
 
+        if cache_key:
+            shared_cache.put_features(cache_key, features_found)
         return features_found
 
     def analyze(self, cattle_lat, cattle_lon, polygon_coords):
@@ -95,7 +117,7 @@ class GeoAnalyzer:
             
             # 3. Scan Area (What is around?)
             # We scan the area inside the polygon as requested
-            nearby_objects = self.scan_for_features(user_polygon)
+            nearby_objects = self.scan_for_features(user_polygon, cache_key=polygon_coords)
 
             return {
                 "status": "success",
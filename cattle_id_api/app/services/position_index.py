@@ -0,0 +1,195 @@
+import time
+import logging
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from cattle_id_api.app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371008.8
+
+class PositionIndex:
+    """
+    In-memory store of each device's last known position.
+    Positions live in one contiguous (n, 2) array of [lat, lon] radians with a
+    haversine BallTree on top. The tree is rebuilt lazily on the first query
+    after a change, at most once per rebuild_interval seconds; in between,
+    queries answer from the previous snapshot (distances and locations both
+    at most that many seconds old, and always consistent with each other).
+    """
+
+    def __init__(self, capacity=1024, rebuild_interval=None):
+        self._ids = []          # row -> cattle_id
+        self._rows = {}         # cattle_id -> row
+        self._coords = np.empty((capacity, 2), dtype=float)
+        self._updated_ms = np.zeros(capacity, dtype=np.int64)
+        self._tree = None
+        self._dirty = False
+        self._built_at = 0.0
+        self._tree_size = 0
+        self._tree_coords = np.empty((0, 2), dtype=float)
+        self._tree_updated_ms = np.zeros(0, dtype=np.int64)
+        self.rebuild_interval = settings.POSITION_REBUILD_INTERVAL if rebuild_interval is None else rebuild_interval
+
+    def __len__(self):
+        return len(self._ids)
+
+    # --- Updates ---
+
+    def update(self, cattle_id, lat, lon, ts_ms=None):
+        """
+        Stores a device's latest fix. (0, 0) means 'no GPS fix' and is ignored,
+        as are fixes older than the one already held. ts_ms is the fix time.
+        """
+        if lat is None or lon is None or (lat == 0 and lon == 0):
+            return
+
+        coords = np.radians([lat, lon])
+        row = self._rows.get(cattle_id)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._coords):
+                self._grow()
+            self._ids.append(cattle_id)
+            self._rows[cattle_id] = row
+        elif ts_ms is not None and ts_ms < self._updated_ms[row]:
+            return
+        elif np.array_equal(self._coords[row], coords):
+            # Same spot: refresh the fix time only, the tree stays valid
+            if ts_ms is not None:
+                self._updated_ms[row] = ts_ms
+            return
+
+        self._coords[row] = coords
+        if ts_ms is not None:
+            self._updated_ms[row] = ts_ms
+        self._dirty = True
+
+    def update_many(self, positions):
+        """Bulk load from an iterable of (cattle_id, lat, lon, ts_ms) tuples."""
+        for cattle_id, lat, lon, ts_ms in positions:
+            self.update(cattle_id, lat, lon, ts_ms)
+        logger.debug(f"Position index holds {len(self)} devices")
+
+    def _grow(self):
+        capacity = len(self._coords) * 2
+        coords = np.empty((capacity, 2), dtype=float)
+        coords[:len(self._ids)] = self._coords[:len(self._ids)]
+        updated = np.zeros(capacity, dtype=np.int64)
+        updated[:len(self._ids)] = self._updated_ms[:len(self._ids)]
+        self._coords, self._updated_ms = coords, updated
+
+    def _get_tree(self):
+        now = time.monotonic()
+        if self._tree is None or (self._dirty and now - self._built_at >= self.rebuild_interval):
+            # Snapshot: the tree and every result read from it use the same coordinates,
+            # even while _coords keeps changing until the next rebuild
+            n = len(self._ids)
+            self._tree_coords = self._coords[:n].copy()
+            self._tree_updated_ms = self._updated_ms[:n].copy()
+            self._tree = BallTree(self._tree_coords, metric="haversine")
+            self._dirty = False
+            self._built_at = now
+            self._tree_size = n
+        return self._tree
+
+    def _subset(self, cattle_ids):
+        """
+        (tree, rows) over only the given animals, built from the current snapshot.
+        'rows' maps the subset tree's indices back to snapshot rows.
+        """
+        self._get_tree()
+        rows = np.array(
+            sorted(r for r in (self._rows.get(c) for c in set(cattle_ids)) if r is not None and r < self._tree_size),
+            dtype=int,
+        )
+        if len(rows) == 0: return None, rows
+        return BallTree(self._tree_coords[rows], metric="haversine"), rows
+
+    def _format(self, rows, distances):
+        return [
+            {
+                "cattle_id": self._ids[row],
+                "distance_m": round(float(dist) * EARTH_RADIUS_M, 1),
+                "location": {
+                    "lat": float(np.degrees(self._tree_coords[row, 0])),
+                    "lon": float(np.degrees(self._tree_coords[row, 1]))
+                },
+                "updated_ms": int(self._tree_updated_ms[row])
+            }
+            for row, dist in zip(rows, distances)
+        ]
+
+    # --- Queries ---
+
+    def get(self, cattle_id):
+        row = self._rows.get(cattle_id)
+        if row is None: return None
+        lat, lon = np.degrees(self._coords[row])
+        return {"lat": float(lat), "lon": float(lon)}
+
+    def within_radius(self, lat, lon, radius_m, cattle_ids=None):
+        """All devices (or only cattle_ids) within radius_m of (lat, lon), closest first."""
+        if not self._ids: return []
+
+        point = np.radians([[lat, lon]])
+        rows, distances = self._get_tree().query_radius(
+            point, r=radius_m / EARTH_RADIUS_M, return_distance=True, sort_results=True
+        )
+        results = self._format(rows[0], distances[0])
+        if cattle_ids is not None:
+            cattle_ids = set(cattle_ids)
+            results = [r for r in results if r["cattle_id"] in cattle_ids]
+        return results
+
+    def _query(self, points, k, cattle_ids):
+        """k nearest candidates for each point, among all devices or only cattle_ids."""
+        if cattle_ids is None:
+            tree, mapping = self._get_tree(), None
+        else:
+            tree, mapping = self._subset(cattle_ids)
+            if tree is None: return [[] for _ in points]
+
+        size = self._tree_size if mapping is None else len(mapping)
+        distances, rows = tree.query(points, k=min(k, size))
+        if mapping is not None:
+            rows = mapping[rows]
+        return [self._format(r, d) for r, d in zip(rows, distances)]
+
+    def nearest(self, cattle_id, k=1, cattle_ids=None):
+        """
+        The k closest other devices to one animal, or None if it is not indexed.
+        With cattle_ids, both the animal and its neighbours must be in that set.
+        """
+        row = self._rows.get(cattle_id)
+        if row is None or (cattle_ids is not None and cattle_id not in set(cattle_ids)): return None
+
+        # +1 because the animal finds itself first
+        found = self._query(self._coords[row:row + 1], k + 1, cattle_ids)[0]
+        return [r for r in found if r["cattle_id"] != cattle_id][:k]
+
+    def nearest_all(self, k=1, cattle_ids=None):
+        """
+        Nearest neighbours for every indexed animal in one batched query.
+        With cattle_ids, only those animals are queried and only they can be neighbours.
+        """
+        if len(self._ids) < 2: return {}
+
+        self._get_tree()
+        if cattle_ids is None:
+            rows = np.arange(self._tree_size)
+        else:
+            rows = np.array(sorted(
+                r for r in (self._rows.get(c) for c in set(cattle_ids)) if r is not None and r < self._tree_size
+            ), dtype=int)
+        if len(rows) == 0: return {}
+
+        found = self._query(self._tree_coords[rows], k + 1, cattle_ids)
+        return {
+            self._ids[row]: [r for r in neighbours if r["cattle_id"] != self._ids[row]][:k]
+            for row, neighbours in zip(rows, found)
+        }
+
+position_index = PositionIndex()
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+
+from cattle_id_api.app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Full directory re-scan at least this often, so writes from other workers are counted
+RESCAN_EVERY_WRITES = 200
+
+class SharedCache:
+    """
+    File-backed cache of formatted OSM feature lists, shared by every worker
+    process on the node. A hit skips building the GeoDataFrame and iterating
+    it (the Overpass request itself is already cached by osmnx).
+    Entries are written atomically (rename), so readers never see partial files.
+    Entries expire after 'ttl' seconds; total size is capped and least
+    recently used entries (by mtime) are evicted.
+    Any I/O failure is treated as a cache miss.
+    """
+
+    def __init__(self, root=None, max_bytes=None, ttl=None):
+        self.root = root or settings.SHARED_CACHE_DIR
+        self.max_bytes = max_bytes or settings.SHARED_CACHE_MAX_BYTES
+        self.ttl = settings.SHARED_CACHE_TTL if ttl is None else ttl
+        # Size estimate: last directory scan + this worker's writes since then
+        self._approx_bytes = None
+        self._writes_since_scan = 0
+
+    @staticmethod
+    def key_for(*parts):
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"osm-{key}.json")
+
+    def _write(self, path, data):
+        os.makedirs(self.root, exist_ok=True)
+        # Write to a private temp file, then rename: other workers never see partial files
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        # Only scan the directory when the estimate says we may be over the cap
+        self._writes_since_scan += 1
+        if self._approx_bytes is not None:
+            self._approx_bytes += len(data)
+        if (self._approx_bytes is None or self._approx_bytes > self.max_bytes
+                or self._writes_since_scan >= RESCAN_EVERY_WRITES):
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".tmp"): continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue # Removed by another worker
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_bytes: break
+
+        self._approx_bytes = total
+        self._writes_since_scan = 0
+
+    # --- OSM features ---
+
+    def get_features(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            # Expiry uses the stored write time; mtime is bumped on every hit for LRU
+            if time.time() - entry["created"] > self.ttl:
+                os.remove(path)
+                return None
+            os.utime(path) # Mark as recently used for LRU eviction
+            return entry["features"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Shared cache entry unreadable ({key}): {e}")
+            return None
+
+    def put_features(self, key, features):
+        try:
+            # allow_nan keeps missing names as NaN, exactly as scan_for_features returns them
+            entry = {"created": time.time(), "features": features}
+            data = json.dumps(entry, allow_nan=True, default=str).encode("utf-8")
+            self._write(self._path(key), data)
+        except OSError as e:
+            logger.warning(f"Shared cache write failed: {e}")
+
+shared_cache = SharedCache()
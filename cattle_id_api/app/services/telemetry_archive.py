@@ -0,0 +1,295 @@
+import os
+import uuid
+import asyncio
+from urllib.parse import quote
+import logging
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from cattle_id_api.app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Flattened layout of one device fix. 'device_id' and 'day' are stored as
+# hive partition directories (device_id=<id>/day=<YYYY-MM-DD>/) not as columns.
+FIX_SCHEMA = pa.schema([
+    ("ts_ms", pa.int64()),
+    ("gps_lat", pa.float64()),
+    ("gps_lon", pa.float64()),
+    ("battery_voltage", pa.float64()),
+    ("battery_percent", pa.float64()),
+    ("label", pa.string()),
+    ("source", pa.string()),    # Mongo collection the fix was exported from
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("device_id", pa.string()), ("day", pa.string())]),
+    flavor="hive",
+)
+
+# Layout inside one device_id=<id>/ directory (per-device reads)
+DAY_PARTITIONING = ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+
+# Deterministic order used by compaction: ties on (ts_ms, source) are broken
+# by the rest of the row, labeled rows first
+SORT_KEYS = [
+    ("ts_ms", "ascending"), ("source", "ascending"), ("label", "ascending"),
+    ("gps_lat", "ascending"), ("gps_lon", "ascending"),
+    ("battery_voltage", "ascending"), ("battery_percent", "ascending"),
+]
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _drop_repeats(table, keys):
+    """Keeps the first row of each run of equal 'keys' values (table must be sorted)."""
+    if table.num_rows < 2:
+        return table
+    values = [table.column(key).to_pylist() for key in keys]
+    keep = [
+        i for i in range(table.num_rows)
+        if i == 0 or any(column[i] != column[i - 1] for column in values)
+    ]
+    return table.take(keep)
+
+
+def flatten_fix(document, collection=None):
+    """
+    Flattens one raw Mongo fix into a single archive row.
+    Handles both the 'meta' layout of the devices collection and the root
+    layout of the labeled training data. 'collection' is recorded as 'source'.
+    Returns None if the fix has no usable timestamp.
+    """
+    meta = document.get("meta") or {}
+    source = meta if "gps" in meta else document
+    gps = source.get("gps") or {}
+    battery = source.get("battery") or {}
+
+    ts_ms = battery.get("ts_ms", source.get("ts_ms", document.get("ts_ms")))
+    device_id = document.get("device_id", document.get("_id"))
+    label = document.get("label")
+    if ts_ms is None or device_id is None:
+        return None
+
+    try:
+        ts_ms = int(ts_ms)
+        day = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None # Unparseable or out-of-range timestamp
+
+    return {
+        "device_id": str(device_id),
+        "day": day,
+        "ts_ms": ts_ms,
+        "gps_lat": _to_float(gps.get("lat")),
+        "gps_lon": _to_float(gps.get("lon")),
+        "battery_voltage": _to_float(battery.get("voltage")),
+        "battery_percent": _to_float(battery.get("percent")),
+        "label": str(label) if label is not None else None,
+        "source": collection,
+    }
+
+
+class TelemetryArchive:
+    def __init__(self, root=None):
+        self.root = root or settings.ARCHIVE_DIR
+        # Memory-mapped reads: Parquet pages are paged in by the OS on demand
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+
+    def exists(self):
+        return os.path.isdir(self.root) and any(
+            name.startswith("device_id=") for name in os.listdir(self.root)
+        )
+
+    # --- Writing ---
+
+    def write_rows(self, rows):
+        """Appends flattened rows as new Parquet files in their device/day partitions."""
+        if not rows:
+            return 0
+
+        columns = {name: [row[name] for row in rows] for name in FIX_SCHEMA.names}
+        columns["device_id"] = [row["device_id"] for row in rows]
+        columns["day"] = [row["day"] for row in rows]
+        schema = FIX_SCHEMA.append(pa.field("device_id", pa.string())).append(pa.field("day", pa.string()))
+        table = pa.Table.from_pydict(columns, schema=schema)
+
+        ds.write_dataset(
+            table,
+            self.root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            filesystem=self.filesystem,
+        )
+        return table.num_rows
+
+    async def export_from_mongo(self, db, collection_name, batch_size=5000):
+        """
+        Streams a Mongo collection into the archive in batches.
+        Re-exporting is safe: duplicate fixes are removed by compact().
+        """
+        cursor = db[collection_name].find({}, batch_size=batch_size)
+        batch, written = [], 0
+
+        async for document in cursor:
+            row = flatten_fix(document, collection_name)
+            if row:
+                batch.append(row)
+            if len(batch) >= batch_size:
+                written += await asyncio.to_thread(self.write_rows, batch)
+                batch = []
+
+        written += await asyncio.to_thread(self.write_rows, batch)
+        logger.info(f"Archived {written} fixes from '{collection_name}'")
+        return written
+
+    def compact(self):
+        """
+        Rewrites every device/day partition with more than one file into a
+        single file, sorted by ts_ms and without duplicate fixes. A fix is a
+        duplicate if the same collection exported the same ts_ms twice; the
+        survivor is chosen by SORT_KEYS, so it does not depend on file order.
+        """
+        compacted = 0
+        if not os.path.isdir(self.root):
+            return compacted
+
+        for device_dir in os.listdir(self.root):
+            device_path = os.path.join(self.root, device_dir)
+            if not os.path.isdir(device_path):
+                continue
+            for day_dir in os.listdir(device_path):
+                day_path = os.path.join(device_path, day_dir)
+                files = sorted(
+                    os.path.join(day_path, f) for f in os.listdir(day_path) if f.endswith(".parquet")
+                )
+                if len(files) < 2:
+                    continue
+
+                table = pa.concat_tables(
+                    [pq.ParquetFile(f, memory_map=True).read() for f in files]
+                )
+                table = _drop_repeats(table.sort_by(SORT_KEYS), ["ts_ms", "source"])
+
+                target = os.path.join(day_path, f"part-{uuid.uuid4().hex}-0.parquet")
+                pq.write_table(table, target + ".tmp")
+                os.replace(target + ".tmp", target)
+                for f in files:
+                    os.remove(f)
+                compacted += 1
+
+        logger.info(f"Compacted {compacted} partitions")
+        return compacted
+
+    # --- Reading ---
+
+    def _device_path(self, device_id):
+        # Partition values are URI-encoded by write_dataset
+        return os.path.join(self.root, f"device_id={quote(str(device_id), safe='')}")
+
+    def _dataset(self, device_id=None):
+        # A single device only lists its own day directories, not the whole archive
+        if device_id is not None:
+            return ds.dataset(
+                self._device_path(device_id),
+                format="parquet",
+                partitioning=DAY_PARTITIONING,
+                schema=FIX_SCHEMA.append(pa.field("day", pa.string())),
+                filesystem=self.filesystem,
+            )
+        return ds.dataset(
+            self.root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            # Explicit schema: files archived before 'source' existed read it as null
+            schema=FIX_SCHEMA.append(pa.field("device_id", pa.string())).append(pa.field("day", pa.string())),
+            filesystem=self.filesystem,
+        )
+
+    def read(self, columns=None, device_id=None, start_ms=None, end_ms=None, source=None):
+        """
+        Reads fixes as an Arrow table. Only the requested columns are decoded
+        and partitions outside the device/day filter are never opened.
+        """
+        expr = None
+
+        def _and(current, condition):
+            return condition if current is None else current & condition
+
+        if source is not None:
+            expr = _and(expr, ds.field("source") == source)
+        if start_ms is not None:
+            start_day = datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+            expr = _and(expr, (ds.field("day") >= start_day) & (ds.field("ts_ms") >= start_ms))
+        if end_ms is not None:
+            end_day = datetime.fromtimestamp(end_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+            expr = _and(expr, (ds.field("day") <= end_day) & (ds.field("ts_ms") <= end_ms))
+
+        return self._dataset(device_id).to_table(columns=columns, filter=expr)
+
+    def get_track(self, device_id, start_ms=None, end_ms=None, limit=None):
+        """Returns one animal's fixes ordered by time, for history queries."""
+        if not os.path.isdir(self._device_path(device_id)):
+            return []
+
+        table = self.read(
+            columns=["ts_ms", "gps_lat", "gps_lon", "battery_voltage", "battery_percent", "source"],
+            device_id=device_id,
+            start_ms=start_ms,
+            end_ms=end_ms,
+        )
+        # One point per timestamp even when several collections archived it
+        table = _drop_repeats(table.sort_by([("ts_ms", "ascending"), ("source", "ascending")]), ["ts_ms"])
+
+        if limit is not None and table.num_rows > limit:
+            # Most recent points win
+            table = table.slice(table.num_rows - limit)
+
+        return [
+            {
+                "ts_ms": row["ts_ms"],
+                "lat": row["gps_lat"],
+                "lon": row["gps_lon"],
+                "voltage": row["battery_voltage"],
+                "percent": row["battery_percent"],
+            }
+            for row in table.to_pylist()
+        ]
+
+    def to_pandas(self, columns=None, source=None):
+        """Archive frame for training, optionally one source collection (device_id is a column)."""
+        return self.read(columns=columns, source=source).to_pandas()
+
+
+telemetry_archive = TelemetryArchive()
+
+
+async def run_export_job(collection_name=None):
+    """Export + compaction job: `python -m cattle_id_api.app.services.telemetry_archive`"""
+    from cattle_id_api.app.services.db_manager import db_instance
+
+    await db_instance.connect_to_database()
+    try:
+        for name in ([collection_name] if collection_name else [settings.TRAINING_COLLECTION, settings.CATTLE_COLLECTION]):
+            await telemetry_archive.export_from_mongo(db_instance.db, name)
+        await asyncio.to_thread(telemetry_archive.compact)
+    finally:
+        await db_instance.close_database_connection()
+    print(f"✅ Archive ready at: {telemetry_archive.root}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    asyncio.run(run_export_job(sys.argv[1] if len(sys.argv) > 1 else None))
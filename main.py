@@ -41,10 +41,11 @@ def read_root():
 # Lifespan events handles startup and shutdown logic
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Connect to DB
+    # Startup: Connect to DB, keep the herd proximity index fresh in the background
     await db_instance.connect_to_database()
+    db_instance.start_position_refresh()
     yield
-    # Shutdown: Close DB connection
+    # Shutdown: Flush buffered status writes, then close DB connection
     await db_instance.close_database_connection()
 
 app = FastAPI(